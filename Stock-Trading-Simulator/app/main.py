@@ -47,20 +47,19 @@ async def get_user_id(x_user_id: Optional[str] = Header(default=None)) -> str:
 
 
 @app.get("/api/stocks", response_model=MarketSnapshot)
-async def list_stocks() -> MarketSnapshot:
-    return MarketSnapshot.parse_obj(market.snapshot())
+async def list_stocks() -> dict[str, object]:
+    return market.snapshot()
 
 
 @app.get("/api/portfolio", response_model=PortfolioView)
-async def get_portfolio(user_id: str = Depends(get_user_id)) -> PortfolioView:
-    return PortfolioView.parse_obj(market.portfolio_view(user_id))
+async def get_portfolio(user_id: str = Depends(get_user_id)) -> dict[str, object]:
+    return market.portfolio_view(user_id)
 
 
 @app.post("/api/trade", response_model=TradeResponse)
-async def trade(request: TradeRequest, user_id: str = Depends(get_user_id)) -> TradeResponse:
+async def trade(request: TradeRequest, user_id: str = Depends(get_user_id)) -> dict[str, object]:
     try:
-        result = market.execute_trade(user_id=user_id, symbol=request.symbol, quantity=request.quantity, side=request.side)
-        return TradeResponse.parse_obj(result)
+        return market.execute_trade(user_id=user_id, symbol=request.symbol, quantity=request.quantity, side=request.side)
     except ValueError as exc:  # business rule violation
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except KeyError:
@@ -88,7 +87,7 @@ async def websocket_quotes(websocket: WebSocket) -> None:
 async def _consume(queue: asyncio.Queue, websocket: WebSocket) -> None:
     try:
         while True:
-            snapshot = await queue.get()
-            await websocket.send_json(snapshot)
+            payload = await queue.get()
+            await websocket.send_text(payload)
     except asyncio.CancelledError:
         return
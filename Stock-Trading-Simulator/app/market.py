@@ -9,6 +9,7 @@ from datetime import date, datetime, time, timedelta
 from enum import Enum
 from typing import Deque, Dict, List, Optional
 
+import orjson
 import pytz
 
 
@@ -310,13 +311,13 @@ class Market:
     async def _broadcast(self, now: datetime) -> None:
         if not self.subscribers:
             return
-        snapshot = self.snapshot(now)
+        payload = self.snapshot_frame(now)
         queues = list(self.subscribers.values())
         for queue in queues:
             if queue.full():
                 with contextlib.suppress(asyncio.QueueEmpty):
                     queue.get_nowait()
-            await queue.put(snapshot)
+            await queue.put(payload)
 
     def snapshot(self, now: Optional[datetime] = None) -> Dict[str, object]:
         now = now or self.clock.now()
@@ -326,6 +327,10 @@ class Market:
             "stocks": [stock.to_dict() for stock in self.stocks.values()],
         }
 
+    def snapshot_frame(self, now: Optional[datetime] = None) -> str:
+        """Serialize the snapshot once so every subscriber shares the same text frame."""
+        return orjson.dumps(self.snapshot(now)).decode("utf-8")
+
     def _seed_stocks(self) -> Dict[str, Stock]:
         companies = [
             ("ALIB", "阿里巴巴集团"),
@@ -352,12 +357,12 @@ class Market:
         ]
         random.shuffle(companies)
         stock_count = random.randint(10, 20)
-        selections = companies[:stock_count]
+        selections = sorted(companies[:stock_count], key=lambda company: company[0])
         stocks: Dict[str, Stock] = {}
         for symbol, name in selections:
             base_price = random.uniform(8, 180)
             stocks[symbol] = Stock(symbol=symbol, name=name, previous_close=round(base_price, 2))
-        return dict(sorted(stocks.items()))
+        return stocks
 
     def create_account(self) -> Portfolio:
         user_id = uuid.uuid4().hex
@@ -418,7 +423,7 @@ class Market:
         queue: asyncio.Queue = asyncio.Queue(maxsize=1)
         self.subscribers[client_id] = queue
         # Send immediate snapshot
-        await queue.put(self.snapshot())
+        await queue.put(self.snapshot_frame())
         return queue
 
     async def unregister(self, client_id: str) -> None:
@@ -4,14 +4,16 @@ import os
 from typing import Optional
 
 from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, status
-from fastapi.responses import HTMLResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from .market import Market
+from .market import Market, Subscriber
 from .models import (
     AuthRequest,
     AuthResponse,
+    BatchRequest,
     MarketModeRequest,
     MarketSnapshot,
     PortfolioView,
@@ -21,7 +23,7 @@ from .models import (
 )
 from .storage import AuthenticationError, Storage, UserAlreadyExists
 
-app = FastAPI(title="股票模拟交易平台", version="0.2.0")
+app = FastAPI(title="股票模拟交易平台", version="0.2.0", default_response_class=ORJSONResponse)
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -38,6 +40,7 @@ async def on_startup() -> None:
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
     await market.stop()
+    storage.close()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -66,19 +69,21 @@ async def stock_page(symbol: str, request: Request) -> HTMLResponse:
     )
 
 
-async def get_current_session(x_session_token: Optional[str] = Header(default=None)) -> tuple[str, str]:
+async def get_current_session(
+    x_session_token: Optional[str] = Header(default=None),
+) -> tuple[dict[str, str], str]:
+    """Resolve the session token to ``(user, token)``; the user record comes from the same query."""
     if not x_session_token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="缺少登录凭证，请先登录")
-    user_id = storage.resolve_session(x_session_token)
-    if not user_id:
+    info = storage.session_lookup(x_session_token)
+    if not info:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="登录状态已失效，请重新登录")
-    if not storage.user_exists(user_id):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="账号不存在或已注销")
+    user_id, user = info
     try:
         market.ensure_account(user_id)
     except KeyError as exc:
         raise HTTPException(status_code=404, detail="未找到对应的模拟账户") from exc
-    return user_id, x_session_token
+    return user, x_session_token
 
 
 def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
@@ -90,7 +95,8 @@ def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
 @app.post("/api/register", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
 async def register(payload: AuthRequest) -> AuthResponse:
     try:
-        user = storage.create_user(payload.username, payload.password)
+        # Password hashing is deliberately slow; keep it off the event loop.
+        user = await run_in_threadpool(storage.create_user, payload.username, payload.password)
     except UserAlreadyExists as exc:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
     except ValueError as exc:
@@ -103,7 +109,7 @@ async def register(payload: AuthRequest) -> AuthResponse:
 @app.post("/api/login", response_model=AuthResponse)
 async def login(payload: AuthRequest) -> AuthResponse:
     try:
-        user = storage.authenticate(payload.username, payload.password)
+        user = await run_in_threadpool(storage.authenticate, payload.username, payload.password)
     except AuthenticationError as exc:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc)) from exc
     market.ensure_account(user["user_id"])
@@ -111,53 +117,73 @@ async def login(payload: AuthRequest) -> AuthResponse:
     return AuthResponse(**user, token=token)
 
 
+def _profile_view(user: dict[str, str], token: str) -> dict[str, str]:
+    return {**user, "token": token}
+
+
 @app.get("/api/profile", response_model=AuthResponse)
-async def profile(session: tuple[str, str] = Depends(get_current_session)) -> AuthResponse:
-    user_id, token = session
-    user = storage.get_user(user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="未找到用户信息")
-    return AuthResponse(**user, token=token)
+async def profile(session: tuple[dict[str, str], str] = Depends(get_current_session)) -> dict[str, str]:
+    user, token = session
+    return _profile_view(user, token)
 
 
 @app.get("/api/stocks", response_model=MarketSnapshot)
-async def list_stocks() -> MarketSnapshot:
-    return MarketSnapshot.parse_obj(market.snapshot())
+async def list_stocks() -> ORJSONResponse:
+    # response_model only documents the schema; the snapshot is already in wire format.
+    return ORJSONResponse(market.snapshot())
 
 
 @app.get("/api/stocks/{symbol}", response_model=StockView)
-async def get_stock(symbol: str) -> StockView:
+async def get_stock(symbol: str) -> dict[str, object]:
     stock = market.get_stock(symbol)
     if not stock:
         raise HTTPException(status_code=404, detail="未找到对应的股票")
-    return StockView.parse_obj(stock)
+    return stock
 
 
 @app.get("/api/portfolio", response_model=PortfolioView)
-async def get_portfolio(session: tuple[str, str] = Depends(get_current_session)) -> PortfolioView:
-    user_id, _ = session
-    return PortfolioView.parse_obj(market.portfolio_view(user_id))
+async def get_portfolio(session: tuple[dict[str, str], str] = Depends(get_current_session)) -> ORJSONResponse:
+    user, _ = session
+    return ORJSONResponse(market.portfolio_view(user["user_id"]))
 
 
 @app.post("/api/trade", response_model=TradeResponse)
-async def trade(request: TradeRequest, session: tuple[str, str] = Depends(get_current_session)) -> TradeResponse:
+async def trade(
+    request: TradeRequest, session: tuple[dict[str, str], str] = Depends(get_current_session)
+) -> dict[str, object]:
     try:
-        user_id, _ = session
-        result = market.execute_trade(user_id=user_id, symbol=request.symbol, quantity=request.quantity, side=request.side)
-        return TradeResponse.parse_obj(result)
+        user, _ = session
+        return market.execute_trade(user_id=user["user_id"], symbol=request.symbol, quantity=request.quantity, side=request.side)
     except ValueError as exc:  # business rule violation
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except KeyError:
         raise HTTPException(status_code=404, detail="未找到账户")
 
 
+def _batch_view(name: str, user: dict[str, str], token: str) -> dict[str, object]:
+    # BatchRequest only admits these read-only views; the route never dispatches arbitrary paths.
+    if name == "stocks":
+        return market.snapshot()
+    if name == "portfolio":
+        return market.portfolio_view(user["user_id"])
+    return _profile_view(user, token)
+
+
+@app.post("/api/batch")
+async def batch(
+    payload: BatchRequest, session: tuple[dict[str, str], str] = Depends(get_current_session)
+) -> ORJSONResponse:
+    user, token = session
+    return ORJSONResponse({name: _batch_view(name, user, token) for name in dict.fromkeys(payload.requests)})
+
+
 @app.websocket("/ws/quotes")
 async def websocket_quotes(websocket: WebSocket) -> None:
     await websocket.accept()
     client_id = id(websocket)
-    queue = await market.register(str(client_id))
+    subscriber = await market.register(str(client_id))
     try:
-        consumer = asyncio.create_task(_consume(queue, websocket))
+        consumer = asyncio.create_task(_consume(subscriber, websocket))
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
@@ -169,17 +195,17 @@ async def websocket_quotes(websocket: WebSocket) -> None:
         await market.unregister(str(client_id))
 
 
-async def _consume(queue: asyncio.Queue, websocket: WebSocket) -> None:
+async def _consume(subscriber: Subscriber, websocket: WebSocket) -> None:
     try:
         while True:
-            snapshot = await queue.get()
-            await websocket.send_json(snapshot)
+            payload = await subscriber.get()
+            await websocket.send_text(payload)
     except asyncio.CancelledError:
         return
 
 
 @app.post("/api/logout", status_code=status.HTTP_204_NO_CONTENT)
-async def logout(session: tuple[str, str] = Depends(get_current_session)) -> Response:
+async def logout(session: tuple[dict[str, str], str] = Depends(get_current_session)) -> Response:
     _, token = session
     storage.delete_session(token)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
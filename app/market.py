@@ -1,18 +1,25 @@
 import asyncio
 import contextlib
+import itertools
 import os
 import random
 from collections import deque
 from dataclasses import dataclass, field
-from datetime import date, datetime, time, timedelta
+from datetime import date, datetime, time, timedelta, timezone
 from enum import Enum
-from typing import Deque, Dict, List, Optional
+from typing import Deque, Dict, Optional, Tuple
 
+import numpy as np
+import orjson
 import pytz
 
 from .data.stocks import CSI300_CONSTITUENTS
 from .storage import Storage
 
+TRADE_HISTORY_LIMIT = 200
+VIEW_HISTORY_LIMIT = 50
+BROADCAST_COALESCE_MS = 250
+
 
 class MarketPhase(Enum):
     PREOPEN = "preopen"
@@ -26,12 +33,6 @@ class MarketPhase(Enum):
         return self in {MarketPhase.MORNING, MarketPhase.AFTERNOON}
 
 
-@dataclass
-class PricePoint:
-    timestamp: datetime
-    price: float
-
-
 @dataclass
 class Stock:
     symbol: str
@@ -43,26 +44,37 @@ class Stock:
     current_price: float = field(init=False)
     day_high: float = field(init=False)
     day_low: float = field(init=False)
-    history: Deque[PricePoint] = field(default_factory=deque, init=False)
+    # Points are kept in their JSON form so snapshots don't re-format them every tick.
+    history: Deque[Dict[str, object]] = field(default_factory=deque, init=False)
+    _limit_up: float = field(init=False, repr=False)
+    _limit_down: float = field(init=False, repr=False)
 
     def __post_init__(self) -> None:
+        # Prices are stored rounded to the cent, so serialization can use them as-is.
+        self.previous_close = round(self.previous_close, 2)
         self.open_price = self.previous_close
         self.current_price = self.previous_close
         self.day_high = self.previous_close
         self.day_low = self.previous_close
+        self._refresh_limits()
         self.history = deque(maxlen=self.history_limit)
-        self.append_history(datetime.utcnow(), self.current_price)
+        self.append_history(datetime.now(timezone.utc).isoformat(), self.current_price)
+
+    def append_history(self, ts_iso: str, price: float) -> None:
+        self.history.append({"timestamp": ts_iso, "price": price})
 
-    def append_history(self, ts: datetime, price: float) -> None:
-        self.history.append(PricePoint(timestamp=ts, price=price))
+    def _refresh_limits(self) -> None:
+        # Limits only move when previous_close does, i.e. once per trading day.
+        self._limit_up = round(self.previous_close * (1 + self.limit_ratio), 2)
+        self._limit_down = round(self.previous_close * (1 - self.limit_ratio), 2)
 
     @property
     def limit_up(self) -> float:
-        return round(self.previous_close * (1 + self.limit_ratio), 2)
+        return self._limit_up
 
     @property
     def limit_down(self) -> float:
-        return round(self.previous_close * (1 - self.limit_ratio), 2)
+        return self._limit_down
 
     @property
     def change(self) -> float:
@@ -78,43 +90,34 @@ class Stock:
         return {
             "symbol": self.symbol,
             "name": self.name,
-            "price": round(self.current_price, 2),
-            "open": round(self.open_price, 2),
-            "prev_close": round(self.previous_close, 2),
-            "high": round(self.day_high, 2),
-            "low": round(self.day_low, 2),
+            "price": self.current_price,
+            "open": self.open_price,
+            "prev_close": self.previous_close,
+            "high": self.day_high,
+            "low": self.day_low,
             "change": self.change,
             "change_percent": self.change_percent,
             "limit_up": self.limit_up,
             "limit_down": self.limit_down,
-            "history": [
-                {
-                    "timestamp": point.timestamp.isoformat(),
-                    "price": round(point.price, 2),
-                }
-                for point in list(self.history)
-            ],
+            "history": list(self.history),
         }
 
-    def update_price(self, pct_change: float, now: datetime) -> None:
-        limit_up_price = self.limit_up
-        limit_down_price = self.limit_down
-        new_price = self.current_price * (1 + pct_change)
-        new_price = min(max(new_price, limit_down_price), limit_up_price)
-        new_price = round(new_price, 2)
-        self.current_price = max(new_price, 0.01)
-        self.day_high = max(self.day_high, self.current_price)
-        self.day_low = min(self.day_low, self.current_price)
-        self.append_history(now, self.current_price)
-
-    def start_new_session(self, now: datetime) -> None:
+    def apply_price(self, price: float, now_iso: str) -> None:
+        """Record an already clamped and rounded price for this tick."""
+        self.current_price = price
+        self.day_high = max(self.day_high, price)
+        self.day_low = min(self.day_low, price)
+        self.append_history(now_iso, price)
+
+    def start_new_session(self, now_iso: str) -> None:
         self.open_price = self.current_price
         self.day_high = self.current_price
         self.day_low = self.current_price
-        self.append_history(now, self.current_price)
+        self.append_history(now_iso, self.current_price)
 
     def close_session(self) -> None:
         self.previous_close = self.current_price
+        self._refresh_limits()
 
 
 class MarketClock:
@@ -137,6 +140,8 @@ class MarketClock:
         self.tick_seconds = tick_seconds
         self.simulation_speed = simulation_speed
         self.force_open = force_open
+        self._boundaries_date: Optional[date] = None
+        self._boundaries: Dict[MarketPhase, datetime] = {}
 
     def now(self) -> datetime:
         return datetime.now(self.tz)
@@ -183,20 +188,23 @@ class MarketClock:
     def _countdown(self, now: datetime, phase: MarketPhase) -> Optional[int]:
         """Return seconds to the next market event."""
         day = now.date()
-        if phase == MarketPhase.PREOPEN:
-            target = datetime.combine(day, self.morning_open, tzinfo=self.tz)
-        elif phase == MarketPhase.MORNING:
-            target = datetime.combine(day, self.morning_close, tzinfo=self.tz)
-        elif phase == MarketPhase.MIDDAY_BREAK:
-            target = datetime.combine(day, self.afternoon_open, tzinfo=self.tz)
-        elif phase == MarketPhase.AFTERNOON:
-            target = datetime.combine(day, self.afternoon_close, tzinfo=self.tz)
-        else:
-            next_day = day + timedelta(days=1)
-            target = datetime.combine(next_day, self.morning_open, tzinfo=self.tz)
-        diff = (target - now).total_seconds()
+        if day != self._boundaries_date:
+            self._recompute_boundaries(day)
+        diff = (self._boundaries[phase] - now).total_seconds()
         return max(0, int(diff))
 
+    def _recompute_boundaries(self, day: date) -> None:
+        """Localize the day's session boundaries once instead of on every status call."""
+        next_day = day + timedelta(days=1)
+        self._boundaries = {
+            MarketPhase.PREOPEN: self.tz.localize(datetime.combine(day, self.morning_open)),
+            MarketPhase.MORNING: self.tz.localize(datetime.combine(day, self.morning_close)),
+            MarketPhase.MIDDAY_BREAK: self.tz.localize(datetime.combine(day, self.afternoon_open)),
+            MarketPhase.AFTERNOON: self.tz.localize(datetime.combine(day, self.afternoon_close)),
+            MarketPhase.CLOSED: self.tz.localize(datetime.combine(next_day, self.morning_open)),
+        }
+        self._boundaries_date = day
+
     @property
     def sleep_interval(self) -> float:
         return max(0.2, self.tick_seconds / max(self.simulation_speed, 0.1))
@@ -218,23 +226,24 @@ class Portfolio:
     user_id: str
     cash: float = 100_000.0
     positions: Dict[str, int] = field(default_factory=dict)
-    trade_history: List[Dict[str, object]] = field(default_factory=list)
+    trade_history: Deque[Dict[str, object]] = field(default_factory=lambda: deque(maxlen=TRADE_HISTORY_LIMIT))
 
-    def to_view(self, stocks: Dict[str, Stock]) -> Dict[str, object]:
+    def to_view(self, stocks: Dict[str, Stock], price_map: Optional[Dict[str, float]] = None) -> Dict[str, object]:
         holdings = []
         total_value = self.cash
         for symbol, quantity in self.positions.items():
             stock = stocks.get(symbol)
             if not stock:
                 continue
-            market_value = round(quantity * stock.current_price, 2)
+            price = price_map[symbol] if price_map is not None else stock.current_price
+            market_value = round(quantity * price, 2)
             total_value += market_value
             holdings.append(
                 {
                     "symbol": symbol,
                     "name": stock.name,
                     "quantity": quantity,
-                    "price": round(stock.current_price, 2),
+                    "price": price,
                     "market_value": market_value,
                 }
             )
@@ -242,10 +251,60 @@ class Portfolio:
             "cash": round(self.cash, 2),
             "total_value": round(total_value, 2),
             "holdings": holdings,
-            "history": self.trade_history[-50:],
+            "history": list(
+                itertools.islice(self.trade_history, max(0, len(self.trade_history) - VIEW_HISTORY_LIMIT), None)
+            ),
         }
 
 
+class Subscriber:
+    """Single-slot mailbox for one quote stream; a newer frame replaces an unread one.
+
+    The first frame is delivered at once and opens a ``coalesce_seconds`` window; frames
+    published while the window is open are held and delivered as one wake-up carrying only
+    the latest frame when it closes.
+    """
+
+    def __init__(self, coalesce_seconds: float = BROADCAST_COALESCE_MS / 1000) -> None:
+        self.buf: Deque[str] = deque(maxlen=1)
+        self.waiter: Optional[asyncio.Future] = None
+        self.coalesce_seconds = coalesce_seconds
+        self._window_end = 0.0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, payload: str, immediate: bool = False) -> None:
+        self.buf.append(payload)
+        if self._flush_handle is not None and not immediate:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if immediate or now >= self._window_end:
+            self.close()
+            self._flush()
+        else:
+            self._flush_handle = loop.call_at(self._window_end, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        self._window_end = asyncio.get_running_loop().time() + self.coalesce_seconds
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def get(self) -> str:
+        while not self.buf or self._flush_handle is not None:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        return self.buf.popleft()
+
+    def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+
 class Market:
     def __init__(self, storage: Storage) -> None:
         speed = float(os.getenv("SIMULATION_SPEED", "1.0"))
@@ -253,12 +312,22 @@ class Market:
         force_open = os.getenv("FORCE_MARKET_OPEN", "0") == "1"
         self.clock = MarketClock(simulation_speed=speed, tick_seconds=tick_seconds, force_open=force_open)
         self.stocks: Dict[str, Stock] = self._seed_stocks()
+        self._rng = np.random.default_rng()
+        # The universe is fixed at startup, so iterate a tuple rather than the dict view.
+        self._stocks_tuple: Tuple[Stock, ...] = tuple(self.stocks.values())
+        self._prices = np.fromiter(
+            (stock.current_price for stock in self._stocks_tuple), dtype=np.float64, count=len(self._stocks_tuple)
+        )
+        self._price_map: Dict[str, float] = {stock.symbol: stock.current_price for stock in self._stocks_tuple}
+        self._limit_ups = np.empty_like(self._prices)
+        self._limit_downs = np.empty_like(self._prices)
+        self._refresh_limits()
         self.accounts: Dict[str, Portfolio] = {}
-        self.subscribers: Dict[str, asyncio.Queue] = {}
+        self.subscribers: Dict[str, Subscriber] = {}
+        self._last_payload: Optional[str] = None
         self._market_task: Optional[asyncio.Task] = None
         self._current_phase: Optional[MarketPhase] = None
         self._day_opened: Optional[date] = None
-        self._lock = asyncio.Lock()
         self.storage = storage
 
     def set_force_open(self, value: bool) -> None:
@@ -281,61 +350,86 @@ class Market:
             await asyncio.sleep(self.clock.sleep_interval)
 
     async def _tick(self) -> None:
+        # The whole tick runs without awaiting, so trades and snapshots (also synchronous)
+        # always observe a fully applied set of prices without needing a lock.
         now = self.clock.now()
+        now_iso = now.isoformat()
         phase = self.clock.phase(now)
         if phase.is_trading:
-            await self._handle_open_session(now)
-            await self._update_prices(now)
+            self._handle_open_session(now, now_iso)
+            self._update_prices(now_iso)
         else:
-            await self._handle_non_trading(phase, now)
-        await self._broadcast(now)
+            self._handle_non_trading(phase, now)
+        self._broadcast(now)
         self._current_phase = phase
 
-    async def _handle_open_session(self, now: datetime) -> None:
+    def _handle_open_session(self, now: datetime, now_iso: str) -> None:
         if self._current_phase and self._current_phase.is_trading:
             return
         # Starting a new trading session (morning or afternoon)
-        async with self._lock:
-            if self._day_opened != now.date():
-                for stock in self.stocks.values():
-                    stock.start_new_session(now)
-                self._day_opened = now.date()
+        if self._day_opened != now.date():
+            for stock in self._stocks_tuple:
+                stock.start_new_session(now_iso)
+            self._day_opened = now.date()
 
-    async def _handle_non_trading(self, phase: MarketPhase, now: datetime) -> None:
+    def _handle_non_trading(self, phase: MarketPhase, now: datetime) -> None:
         if phase == MarketPhase.CLOSED and self.clock.day_closed(now):
             if self._current_phase != MarketPhase.CLOSED:
-                async with self._lock:
-                    for stock in self.stocks.values():
-                        stock.close_session()
-
-    async def _update_prices(self, now: datetime) -> None:
-        async with self._lock:
-            for stock in self.stocks.values():
-                base_volatility = 0.003
-                drift = random.uniform(-0.001, 0.001)
-                shock = random.gauss(0, base_volatility)
-                pct_change = drift + shock
-                stock.update_price(pct_change, now)
-
-    async def _broadcast(self, now: datetime) -> None:
+                for stock in self._stocks_tuple:
+                    stock.close_session()
+                self._refresh_limits()
+
+    def _refresh_limits(self) -> None:
+        for index, stock in enumerate(self._stocks_tuple):
+            self._limit_ups[index] = stock.limit_up
+            self._limit_downs[index] = stock.limit_down
+
+    def _update_prices(self, now_iso: str) -> None:
+        # Random walk for every stock in one vectorized pass: step, clamp to the limits, round.
+        # Draws from PCG64's raw uniform/standard-normal streams and scales in place, which avoids
+        # the loc/scale temporaries of Generator.uniform/normal.
+        count = len(self._stocks_tuple)
+        base_volatility = 0.003
+        prices = self._rng.random(count)
+        prices *= 0.002
+        prices -= 0.001
+        shock = self._rng.standard_normal(count)
+        shock *= base_volatility
+        prices += shock
+        prices += 1.0
+        prices *= self._prices
+        np.clip(prices, self._limit_downs, self._limit_ups, out=prices)
+        np.round(prices, 2, out=prices)
+        np.maximum(prices, 0.01, out=prices)
+        self._prices = prices
+        price_list = prices.tolist()
+        for stock, price in zip(self._stocks_tuple, price_list):
+            stock.apply_price(price, now_iso)
+        self._price_map = dict(zip(self.stocks, price_list))
+
+    def _broadcast(self, now: datetime) -> None:
+        # Never awaits: a slow subscriber just loses its stale frame instead of stalling the tick.
         if not self.subscribers:
+            # Nothing was sent this tick, so the cached frame would be stale.
+            self._last_payload = None
             return
-        snapshot = self.snapshot(now)
-        queues = list(self.subscribers.values())
-        for queue in queues:
-            if queue.full():
-                with contextlib.suppress(asyncio.QueueEmpty):
-                    queue.get_nowait()
-            await queue.put(snapshot)
+        payload = self.snapshot_frame(now)
+        for subscriber in list(self.subscribers.values()):
+            subscriber.publish(payload)
+        self._last_payload = payload
 
     def snapshot(self, now: Optional[datetime] = None) -> Dict[str, object]:
         now = now or self.clock.now()
         return {
             "timestamp": now.isoformat(),
             "market_status": self.clock.status(now),
-            "stocks": [stock.to_dict() for stock in self.stocks.values()],
+            "stocks": [stock.to_dict() for stock in self._stocks_tuple],
         }
 
+    def snapshot_frame(self, now: Optional[datetime] = None) -> str:
+        """Serialize the snapshot once so every subscriber shares the same text frame."""
+        return orjson.dumps(self.snapshot(now)).decode("utf-8")
+
     def get_stock(self, symbol: str) -> Optional[Dict[str, object]]:
         key = symbol.upper()
         stock = self.stocks.get(key)
@@ -358,7 +452,7 @@ class Market:
             return self.accounts[user_id]
         if not self.storage.user_exists(user_id):
             raise KeyError("Account not found")
-        portfolio_data = self.storage.load_portfolio(user_id)
+        portfolio_data = self.storage.load_portfolio(user_id, history_limit=TRADE_HISTORY_LIMIT)
         if not portfolio_data:
             account = Portfolio(user_id=user_id)
         else:
@@ -366,7 +460,7 @@ class Market:
                 user_id=user_id,
                 cash=portfolio_data["cash"],
                 positions=dict(portfolio_data["positions"]),
-                trade_history=list(portfolio_data["history"]),
+                trade_history=deque(portfolio_data["history"], maxlen=TRADE_HISTORY_LIMIT),
             )
         self.accounts[user_id] = account
         return account
@@ -376,7 +470,7 @@ class Market:
 
     def portfolio_view(self, user_id: str) -> Dict[str, object]:
         account = self.get_account(user_id)
-        return account.to_view(self.stocks)
+        return account.to_view(self.stocks, self._price_map)
 
     def execute_trade(self, user_id: str, symbol: str, quantity: int, side: str) -> Dict[str, object]:
         phase = self.clock.phase()
@@ -393,7 +487,7 @@ class Market:
         price = stock.current_price
         cost = quantity * price
         trade_record = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
             "symbol": symbol,
             "name": stock.name,
             "price": round(price, 2),
@@ -416,23 +510,23 @@ class Market:
         else:
             raise ValueError("Unsupported side")
         account.trade_history.append(trade_record)
-        if len(account.trade_history) > 200:
-            account.trade_history[:] = account.trade_history[-200:]
-        self.storage.persist_portfolio(account.user_id, account.cash, account.positions)
-        self.storage.record_trade(account.user_id, trade_record)
+        with self.storage.transaction():
+            self.storage.persist_portfolio(account.user_id, account.cash, account.positions)
+            self.storage.record_trade(account.user_id, trade_record)
         return {
             "result": "success",
             "trade": trade_record,
-            "portfolio": account.to_view(self.stocks),
+            "portfolio": account.to_view(self.stocks, self._price_map),
         }
 
-    async def register(self, client_id: str) -> asyncio.Queue:
-        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
-        self.subscribers[client_id] = queue
-        # Send immediate snapshot
-        await queue.put(self.snapshot())
-        return queue
+    async def register(self, client_id: str) -> Subscriber:
+        subscriber = Subscriber()
+        self.subscribers[client_id] = subscriber
+        # Send immediate snapshot, reusing the current tick's frame when there is one
+        subscriber.publish(self._last_payload or self.snapshot_frame(), immediate=True)
+        return subscriber
 
     async def unregister(self, client_id: str) -> None:
-        if client_id in self.subscribers:
-            del self.subscribers[client_id]
+        subscriber = self.subscribers.pop(client_id, None)
+        if subscriber:
+            subscriber.close()
@@ -86,3 +86,7 @@ class TradeResponse(BaseModel):
     result: Literal["success"]
     trade: TradeRecord
     portfolio: PortfolioView
+
+
+class BatchRequest(BaseModel):
+    requests: List[Literal["stocks", "portfolio", "profile"]] = Field(..., min_items=1)
@@ -1,13 +1,134 @@
+import contextlib
 import hashlib
 import hmac
+import json
 import os
 import secrets
 import sqlite3
 import threading
 import uuid
-from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+LAST_SEEN_FLUSH_SECONDS = 5.0
+WAL_CHECKPOINT_SECONDS = 30.0
+PASSWORD_SCHEME = "scrypt"
+SCHEMA_VERSION = 1
+
+# Statements are module constants so every call hands sqlite3 the same string and hits
+# its prepared-statement cache instead of re-parsing.
+_SQL_INSERT_USER = "INSERT INTO users (user_id, username, password_hash, salt, created_at) VALUES (?, ?, ?, ?, datetime('now'))"
+_SQL_INSERT_ACCOUNT = "INSERT INTO accounts (user_id, cash) VALUES (?, ?)"
+_SQL_SELECT_USER_BY_NAME = "SELECT user_id, username, password_hash, salt FROM users WHERE username = ?"
+_SQL_UPDATE_PASSWORD = "UPDATE users SET password_hash = ?, salt = ? WHERE user_id = ?"
+_SQL_USER_EXISTS = "SELECT 1 FROM users WHERE user_id = ?"
+# One session per user: logging in again replaces the existing row in place.
+_SQL_UPSERT_SESSION = (
+    "INSERT INTO sessions (session_id, user_id, created_at, last_seen) VALUES (?, ?, datetime('now'), datetime('now')) "
+    "ON CONFLICT(user_id) DO UPDATE SET session_id = excluded.session_id, "
+    "created_at = excluded.created_at, last_seen = excluded.last_seen"
+)
+_SQL_SELECT_SESSION_USER = (
+    "SELECT users.user_id, users.username FROM sessions "
+    "JOIN users ON users.user_id = sessions.user_id "
+    "WHERE sessions.session_id = ?"
+)
+_SQL_TOUCH_SESSION = "UPDATE sessions SET last_seen = datetime('now') WHERE session_id = ?"
+_SQL_DELETE_SESSION = "DELETE FROM sessions WHERE session_id = ?"
+_SQL_SELECT_CASH = "SELECT cash FROM accounts WHERE user_id = ?"
+_SQL_SELECT_POSITIONS = "SELECT symbol, quantity FROM positions WHERE user_id = ?"
+_SQL_SELECT_RECENT_TRADES = (
+    "SELECT timestamp, symbol, name, price, quantity, side FROM trades WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+)
+_SQL_UPDATE_CASH = "UPDATE accounts SET cash = ? WHERE user_id = ?"
+_SQL_UPSERT_POSITION = (
+    "INSERT INTO positions (user_id, symbol, quantity) VALUES (?, ?, ?) "
+    "ON CONFLICT (user_id, symbol) DO UPDATE SET quantity = excluded.quantity "
+    "WHERE quantity != excluded.quantity"
+)
+_SQL_DELETE_POSITION = "DELETE FROM positions WHERE user_id = ? AND symbol = ?"
+_SQL_PRUNE_POSITIONS = "DELETE FROM positions WHERE user_id = ? AND symbol NOT IN (SELECT value FROM json_each(?))"
+_SQL_INSERT_TRADE = (
+    "INSERT INTO trades (user_id, timestamp, symbol, name, price, quantity, side) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Ids, salts and session tokens are raw bytes: half the size of their hex form, so rows and
+# indexes are denser and comparisons are plain memcmp. The public API still speaks hex.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id BLOB PRIMARY KEY,
+    username TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    salt BLOB NOT NULL,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS accounts (
+    user_id BLOB PRIMARY KEY,
+    cash REAL NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS positions (
+    user_id BLOB NOT NULL,
+    symbol TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (user_id, symbol),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id BLOB NOT NULL,
+    timestamp TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    quantity INTEGER NOT NULL,
+    side TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id BLOB PRIMARY KEY,
+    user_id BLOB NOT NULL,
+    created_at TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);
+CREATE INDEX IF NOT EXISTS idx_trades_user ON trades(user_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username);
+"""
+
+_MIGRATE_TEXT_IDS_PREPARE = """
+BEGIN;
+DROP INDEX IF EXISTS idx_sessions_user;
+DROP INDEX IF EXISTS idx_trades_user;
+DROP INDEX IF EXISTS idx_users_username;
+DROP TABLE IF EXISTS sessions;
+ALTER TABLE users RENAME TO legacy_users;
+ALTER TABLE accounts RENAME TO legacy_accounts;
+ALTER TABLE positions RENAME TO legacy_positions;
+ALTER TABLE trades RENAME TO legacy_trades;
+"""
+
+_MIGRATE_TEXT_IDS_COPY = """
+INSERT INTO users (user_id, username, password_hash, salt, created_at)
+    SELECT hex_to_blob(user_id), username, password_hash, hex_to_blob(salt), created_at FROM legacy_users;
+INSERT INTO accounts (user_id, cash) SELECT hex_to_blob(user_id), cash FROM legacy_accounts;
+INSERT INTO positions (user_id, symbol, quantity)
+    SELECT hex_to_blob(user_id), symbol, quantity FROM legacy_positions;
+INSERT INTO trades (id, user_id, timestamp, symbol, name, price, quantity, side)
+    SELECT id, hex_to_blob(user_id), timestamp, symbol, name, price, quantity, side FROM legacy_trades;
+DROP TABLE legacy_trades;
+DROP TABLE legacy_positions;
+DROP TABLE legacy_accounts;
+DROP TABLE legacy_users;
+COMMIT;
+"""
 
 
 class UserAlreadyExists(Exception):
@@ -25,69 +146,123 @@ class Storage:
         default_path = Path(os.getenv("SIMULATOR_DB_PATH", "data/simulator.db"))
         self.db_path = Path(db_path) if db_path else default_path
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self._conn.row_factory = sqlite3.Row
-        self._lock = threading.Lock()
+        self._in_memory = str(self.db_path) == ":memory:"
+        # One writer connection behind a short mutex; reads use per-thread connections and,
+        # under WAL, run concurrently with the writer without any Python-level lock.
+        self._conn = self._connect()
+        self._write_lock = threading.RLock()
+        self._transaction_depth = 0
+        self._persisted: Dict[str, Tuple[float, Dict[str, int]]] = {}
+        self._tls = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        if not self._in_memory:
+            # WAL lets reads proceed alongside a writer and, with synchronous=NORMAL, makes
+            # commits sequential appends instead of two fsyncs. In-memory databases can't use WAL.
+            self._conn.execute("PRAGMA journal_mode = WAL;")
+            # Checkpoints run on a background thread instead of stalling whichever commit
+            # happens to push the WAL past the auto-checkpoint threshold.
+            self._conn.execute("PRAGMA wal_autocheckpoint = 0;")
         self._init_schema()
+        # last_seen is soft state: authenticated requests only note the session in memory and a
+        # background thread stamps the batch, so lookups never commit. The stored value is the
+        # flush time, at most LAST_SEEN_FLUSH_SECONDS after the request.
+        self._pending_last_seen: Set[bytes] = set()
+        self._pending_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="storage-last-seen", daemon=True)
+        self._flusher.start()
+        self._checkpointer: Optional[threading.Thread] = None
+        if not self._in_memory:
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="storage-checkpoint", daemon=True)
+            self._checkpointer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(
+            """
+            PRAGMA foreign_keys = ON;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA temp_store = MEMORY;
+            PRAGMA mmap_size = 268435456;
+            PRAGMA cache_size = -65536;
+            PRAGMA busy_timeout = 5000;
+            """
+        )
+        return conn
+
+    @contextlib.contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        if self._in_memory:
+            # Every connection to ":memory:" is a separate database, so share the writer.
+            with self._write_lock:
+                yield self._conn
+            return
+        conn = getattr(self._tls, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._tls.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
+
+    def _commit(self) -> None:
+        # Inside ``transaction()`` the outermost block commits; the write lock is held throughout.
+        if not self._transaction_depth:
+            self._conn.commit()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group several write calls into a single commit, rolling back if any of them fails."""
+        with self._write_lock:
+            if not self._transaction_depth and not self._conn.in_transaction:
+                # Take SQLite's write lock up front instead of upgrading from a read lock
+                # mid-transaction, which is where concurrent writers hit SQLITE_BUSY.
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._transaction_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._transaction_depth -= 1
+                if not self._transaction_depth:
+                    self._conn.rollback()
+                    # The cache may describe writes that were just rolled back.
+                    self._persisted.clear()
+                raise
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                self._conn.commit()
 
     def _init_schema(self) -> None:
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute("PRAGMA foreign_keys = ON;")
-            cur.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    salt TEXT NOT NULL,
-                    created_at TEXT NOT NULL
-                );
-
-                CREATE TABLE IF NOT EXISTS accounts (
-                    user_id TEXT PRIMARY KEY,
-                    cash REAL NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-                );
-
-                CREATE TABLE IF NOT EXISTS positions (
-                    user_id TEXT NOT NULL,
-                    symbol TEXT NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    PRIMARY KEY (user_id, symbol),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-                );
-
-                CREATE TABLE IF NOT EXISTS trades (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    symbol TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    price REAL NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    side TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-                );
-
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL,
-                    created_at TEXT NOT NULL,
-                    last_seen TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-                );
-
-                CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);
-                """
-            )
+        with self._write_lock:
+            version = self._conn.execute("PRAGMA user_version;").fetchone()[0]
+            legacy = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+            ).fetchone()
+            if version < SCHEMA_VERSION and legacy:
+                self._migrate_text_ids()
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
             self._conn.commit()
 
+    def _migrate_text_ids(self) -> None:
+        # Databases created before ids were stored as BLOBs hold hex TEXT ids. Rebuild the
+        # tables with converted ids; sessions are dropped since their tokens were not hex.
+        self._conn.create_function("hex_to_blob", 1, bytes.fromhex, deterministic=True)
+        self._conn.executescript(
+            "PRAGMA foreign_keys = OFF;"
+            + _MIGRATE_TEXT_IDS_PREPARE
+            + _SCHEMA
+            + _MIGRATE_TEXT_IDS_COPY
+            + "PRAGMA foreign_keys = ON;"
+        )
+
     # ------------------------------------------------------------------
     # User management
     # ------------------------------------------------------------------
     def create_user(self, username: str, password: str, initial_cash: float = 100_000.0) -> Dict[str, str]:
-        username = username.strip()
+        username = self._normalize_username(username)
         if not username:
             raise ValueError("用户名不能为空")
         if len(username) < 2:
@@ -95,184 +270,262 @@ class Storage:
         if not password:
             raise ValueError("密码不能为空")
 
-        user_id = uuid.uuid4().hex
-        salt = secrets.token_hex(16)
+        user_key = uuid.uuid4().bytes
+        salt = secrets.token_bytes(16)
         password_hash = self._hash_password(password, salt)
-        with self._lock:
+        with self.transaction():
             cur = self._conn.cursor()
             try:
                 cur.execute(
-                    "INSERT INTO users (user_id, username, password_hash, salt, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
-                    (user_id, username, password_hash, salt),
+                    _SQL_INSERT_USER,
+                    (user_key, username, password_hash, salt),
                 )
             except sqlite3.IntegrityError as exc:
                 raise UserAlreadyExists("用户名已存在") from exc
             cur.execute(
-                "INSERT INTO accounts (user_id, cash) VALUES (?, ?)",
-                (user_id, float(initial_cash)),
+                _SQL_INSERT_ACCOUNT,
+                (user_key, float(initial_cash)),
             )
-            self._conn.commit()
-        return {"user_id": user_id, "username": username}
+        return {"user_id": user_key.hex(), "username": username}
 
     def authenticate(self, username: str, password: str) -> Dict[str, str]:
-        username = username.strip()
+        username = self._normalize_username(username)
         if not username or not password:
             raise AuthenticationError("用户名或密码错误")
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute(
-                "SELECT user_id, username, password_hash, salt FROM users WHERE username = ?",
-                (username,),
-            )
-            row = cur.fetchone()
+        with self._reading() as conn:
+            row = conn.execute(_SQL_SELECT_USER_BY_NAME, (username,)).fetchone()
         if not row:
             raise AuthenticationError("用户名或密码错误")
         expected = row["password_hash"]
         salt = row["salt"]
-        computed = self._hash_password(password, salt)
-        if not hmac.compare_digest(expected, computed):
+        if not self._verify_password(password, salt, expected):
             raise AuthenticationError("用户名或密码错误")
-        return {"user_id": row["user_id"], "username": row["username"]}
-
-    def get_user(self, user_id: str) -> Optional[Dict[str, str]]:
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute(
-                "SELECT user_id, username FROM users WHERE user_id = ?",
-                (user_id,),
-            )
-            row = cur.fetchone()
-        if not row:
-            return None
-        return {"user_id": row["user_id"], "username": row["username"]}
+        if not expected.startswith(PASSWORD_SCHEME + "$"):
+            # Upgrade hashes from the old single-round SHA-256 scheme on successful login.
+            new_salt = secrets.token_bytes(16)
+            new_hash = self._hash_password(password, new_salt)
+            with self._write_lock:
+                self._conn.execute(_SQL_UPDATE_PASSWORD, (new_hash, new_salt, row["user_id"]))
+                self._commit()
+        return {"user_id": row["user_id"].hex(), "username": row["username"]}
 
     def user_exists(self, user_id: str) -> bool:
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-            return cur.fetchone() is not None
+        user_key = self._key(user_id)
+        if user_key is None:
+            return False
+        with self._reading() as conn:
+            return conn.execute(_SQL_USER_EXISTS, (user_key,)).fetchone() is not None
 
     # ------------------------------------------------------------------
     # Session management
     # ------------------------------------------------------------------
     def create_session(self, user_id: str) -> str:
-        session_id = secrets.token_urlsafe(32)
-        timestamp = datetime.utcnow().isoformat()
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
-            cur.execute(
-                "INSERT INTO sessions (session_id, user_id, created_at, last_seen) VALUES (?, ?, ?, ?)",
-                (session_id, user_id, timestamp, timestamp),
-            )
-            self._conn.commit()
-        return session_id
+        session_key = secrets.token_bytes(32)
+        user_key = bytes.fromhex(user_id)
+        with self._write_lock:
+            self._conn.execute(_SQL_UPSERT_SESSION, (session_key, user_key))
+            self._commit()
+        return session_key.hex()
 
-    def resolve_session(self, session_id: str) -> Optional[str]:
-        if not session_id:
+    def session_lookup(self, session_id: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        """Resolve a session token to ``(user_id, user)``, only if that user still exists."""
+        session_key = self._key(session_id)
+        if not session_key:
             return None
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute(
-                "SELECT user_id FROM sessions WHERE session_id = ?",
-                (session_id,),
-            )
-            row = cur.fetchone()
-            if not row:
-                return None
-            cur.execute(
-                "UPDATE sessions SET last_seen = ? WHERE session_id = ?",
-                (datetime.utcnow().isoformat(), session_id),
-            )
-            self._conn.commit()
-            return row["user_id"]
+        with self._reading() as conn:
+            row = conn.execute(_SQL_SELECT_SESSION_USER, (session_key,)).fetchone()
+        if not row:
+            return None
+        with self._pending_lock:
+            self._pending_last_seen.add(session_key)
+        user_id = row["user_id"].hex()
+        return user_id, {"user_id": user_id, "username": row["username"]}
 
     def delete_session(self, session_id: str) -> None:
-        if not session_id:
+        session_key = self._key(session_id)
+        if not session_key:
             return
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-            self._conn.commit()
+        with self._pending_lock:
+            self._pending_last_seen.discard(session_key)
+        with self._write_lock:
+            self._conn.execute(_SQL_DELETE_SESSION, (session_key,))
+            self._commit()
+
+    def flush_last_seen(self) -> None:
+        """Write buffered session ``last_seen`` updates in a single transaction."""
+        with self._pending_lock:
+            if not self._pending_last_seen:
+                return
+            pending = [(session_key,) for session_key in self._pending_last_seen]
+            self._pending_last_seen.clear()
+        with self._write_lock:
+            self._conn.executemany(_SQL_TOUCH_SESSION, pending)
+            self._commit()
+
+    def _flush_loop(self) -> None:
+        while not self._stop_event.wait(LAST_SEEN_FLUSH_SECONDS):
+            self.flush_last_seen()
+
+    def _checkpoint_loop(self) -> None:
+        # A dedicated connection, so PASSIVE checkpoints never wait on the writer's lock;
+        # PASSIVE itself never blocks readers or writers either.
+        conn = self._connect()
+        try:
+            while not self._stop_event.wait(WAL_CHECKPOINT_SECONDS):
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE);")
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        """Stop background work, flush buffered writes and close all connections."""
+        self._stop_event.set()
+        self._flusher.join()
+        if self._checkpointer:
+            self._checkpointer.join()
+        self.flush_last_seen()
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+        with self._write_lock:
+            if not self._in_memory:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            self._conn.close()
 
     # ------------------------------------------------------------------
     # Portfolio management
     # ------------------------------------------------------------------
     def load_portfolio(self, user_id: str, history_limit: int = 200) -> Optional[Dict[str, object]]:
-        with self._lock:
-            cur = self._conn.cursor()
+        user_key = self._key(user_id)
+        if user_key is None:
+            return None
+        with self._reading() as conn:
+            cur = conn.cursor()
+            # Plain tuples: SQLite already returns REAL/INTEGER columns as float/int.
+            cur.row_factory = None
             cur.execute(
-                "SELECT cash FROM accounts WHERE user_id = ?",
-                (user_id,),
+                _SQL_SELECT_CASH,
+                (user_key,),
             )
             account_row = cur.fetchone()
             if not account_row:
                 return None
-            cash = float(account_row["cash"])
+            cash = account_row[0]
             cur.execute(
-                "SELECT symbol, quantity FROM positions WHERE user_id = ?",
-                (user_id,),
+                _SQL_SELECT_POSITIONS,
+                (user_key,),
             )
-            positions_rows = cur.fetchall()
-            positions: Dict[str, int] = {row["symbol"]: int(row["quantity"]) for row in positions_rows}
+            positions: Dict[str, int] = dict(cur.fetchall())
+            # Newest rows first so LIMIT is served by an index range scan; flipped back below.
             cur.execute(
-                "SELECT timestamp, symbol, name, price, quantity, side FROM trades WHERE user_id = ? ORDER BY id ASC",
-                (user_id,),
+                _SQL_SELECT_RECENT_TRADES,
+                (user_key, history_limit),
             )
             trades_rows = cur.fetchall()
         trades: List[Dict[str, object]] = [
             {
-                "timestamp": row["timestamp"],
-                "symbol": row["symbol"],
-                "name": row["name"],
-                "price": float(row["price"]),
-                "quantity": int(row["quantity"]),
-                "side": row["side"],
+                "timestamp": row[0],
+                "symbol": row[1],
+                "name": row[2],
+                "price": row[3],
+                "quantity": row[4],
+                "side": row[5],
             }
-            for row in trades_rows
+            for row in reversed(trades_rows)
         ]
-        if len(trades) > history_limit:
-            trades = trades[-history_limit:]
         return {"cash": cash, "positions": positions, "history": trades}
 
     def persist_portfolio(self, user_id: str, cash: float, positions: Dict[str, int]) -> None:
-        with self._lock:
+        cash = float(cash)
+        positions = {symbol: int(quantity) for symbol, quantity in positions.items()}
+        with self._write_lock:
+            # Only touch rows that differ from what this process last wrote for the user;
+            # an unchanged portfolio costs no SQL at all.
+            persisted = self._persisted.get(user_id)
+            if persisted == (cash, positions):
+                return
+            user_key = bytes.fromhex(user_id)
             cur = self._conn.cursor()
-            cur.execute(
-                "UPDATE accounts SET cash = ? WHERE user_id = ?",
-                (float(cash), user_id),
-            )
-            cur.execute("DELETE FROM positions WHERE user_id = ?", (user_id,))
-            for symbol, quantity in positions.items():
-                cur.execute(
-                    "INSERT INTO positions (user_id, symbol, quantity) VALUES (?, ?, ?)",
-                    (user_id, symbol, int(quantity)),
+            if persisted is None:
+                cur.execute(_SQL_UPDATE_CASH, (cash, user_key))
+                # Upsert only rows whose quantity changed, then prune symbols no longer held,
+                # so unchanged positions don't dirty any pages.
+                cur.executemany(
+                    _SQL_UPSERT_POSITION,
+                    [(user_key, symbol, quantity) for symbol, quantity in positions.items()],
                 )
-            self._conn.commit()
+                cur.execute(_SQL_PRUNE_POSITIONS, (user_key, json.dumps(list(positions))))
+            else:
+                persisted_cash, persisted_positions = persisted
+                if cash != persisted_cash:
+                    cur.execute(_SQL_UPDATE_CASH, (cash, user_key))
+                cur.executemany(
+                    _SQL_UPSERT_POSITION,
+                    [
+                        (user_key, symbol, quantity)
+                        for symbol, quantity in positions.items()
+                        if persisted_positions.get(symbol) != quantity
+                    ],
+                )
+                cur.executemany(
+                    _SQL_DELETE_POSITION,
+                    [(user_key, symbol) for symbol in persisted_positions if symbol not in positions],
+                )
+            self._persisted[user_id] = (cash, positions)
+            self._commit()
 
     def record_trade(self, user_id: str, trade: Dict[str, object]) -> None:
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute(
-                """
-                INSERT INTO trades (user_id, timestamp, symbol, name, price, quantity, side)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    user_id,
-                    trade["timestamp"],
-                    trade["symbol"],
-                    trade["name"],
-                    float(trade["price"]),
-                    int(trade["quantity"]),
-                    trade["side"],
-                ),
+        self.record_trades(user_id, [trade])
+
+    def record_trades(self, user_id: str, trades: List[Dict[str, object]]) -> None:
+        user_key = bytes.fromhex(user_id)
+        params = [
+            (
+                user_key,
+                trade["timestamp"],
+                trade["symbol"],
+                trade["name"],
+                float(trade["price"]),
+                int(trade["quantity"]),
+                trade["side"],
             )
-            self._conn.commit()
+            for trade in trades
+        ]
+        with self._write_lock:
+            self._conn.executemany(_SQL_INSERT_TRADE, params)
+            self._commit()
 
     # ------------------------------------------------------------------
     # Helpers
     # ------------------------------------------------------------------
     @staticmethod
-    def _hash_password(password: str, salt: str) -> str:
-        return hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
+    def _normalize_username(username: str) -> str:
+        # str.strip() hands back the same object when there is nothing to strip, so the
+        # usual already-canonical name costs no allocation.
+        return username.strip()
+
+    @staticmethod
+    def _key(value: str) -> Optional[bytes]:
+        # Ids are stored as raw bytes but travel as hex; anything that isn't hex can't match.
+        try:
+            return bytes.fromhex(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _hash_password(password: str, salt: bytes) -> str:
+        # hashlib.scrypt runs in OpenSSL, which uses the CPU's SHA extensions where available.
+        digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=2**14, r=8, p=1, dklen=32)
+        return f"{PASSWORD_SCHEME}${digest.hex()}"
+
+    @staticmethod
+    def _legacy_hash_password(password: str, salt: bytes) -> str:
+        return hashlib.sha256((salt.hex() + password).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _verify_password(cls, password: str, salt: bytes, expected: str) -> bool:
+        if expected.startswith(PASSWORD_SCHEME + "$"):
+            computed = cls._hash_password(password, salt)
+        else:
+            computed = cls._legacy_hash_password(password, salt)
+        return hmac.compare_digest(expected, computed)